@@ -0,0 +1,23 @@
+"""Add composite (user_id, filename) index for per-user file key lookups
+
+Revision ID: 20261016_add_filerecord_user_filename_index
+Revises: 20261016_add_user_date_indexes
+Create Date: 2026-10-16
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic
+revision = '20261016_add_filerecord_user_filename_index'
+down_revision = '20261016_add_user_date_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Ownership checks look up a user's files by key, often several at once with IN (...)
+    op.create_index('ix_filerecord_user_filename', 'file_record', ['user_id', 'filename'])
+
+
+def downgrade():
+    op.drop_index('ix_filerecord_user_filename', table_name='file_record')
@@ -0,0 +1,9 @@
+-- SQL Migration Script: Add composite (user_id, filename) index for per-user file key lookups
+-- Date: 2026-10-16
+
+BEGIN;
+
+-- /enhanced/merge and other ownership checks: a user's files by key, including IN (...) lists
+CREATE INDEX IF NOT EXISTS ix_filerecord_user_filename ON file_record(user_id, filename);
+
+COMMIT;
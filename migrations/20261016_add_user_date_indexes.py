@@ -0,0 +1,26 @@
+"""Add composite (user_id, date DESC) indexes for per-user listings
+
+Revision ID: 20261016_add_user_date_indexes
+Revises: 20250907_add_tracking_tables
+Create Date: 2026-10-16
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = '20261016_add_user_date_indexes'
+down_revision = '20250907_add_tracking_tables'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # /files and /history filter by user and order by date; these avoid a sort per request
+    op.create_index('ix_filerecord_user_upload', 'file_record', ['user_id', sa.text('upload_date DESC')])
+    op.create_index('ix_processingrecord_user_created', 'processing_record', ['user_id', sa.text('created_at DESC')])
+
+
+def downgrade():
+    op.drop_index('ix_processingrecord_user_created', table_name='processing_record')
+    op.drop_index('ix_filerecord_user_upload', table_name='file_record')
@@ -0,0 +1,12 @@
+-- SQL Migration Script: Add composite (user_id, date DESC) indexes for per-user listings
+-- Date: 2026-10-16
+
+BEGIN;
+
+-- /files: uploads for one user, newest first
+CREATE INDEX IF NOT EXISTS ix_filerecord_user_upload ON file_record(user_id, upload_date DESC);
+
+-- /history: processing records for one user, newest first
+CREATE INDEX IF NOT EXISTS ix_processingrecord_user_created ON processing_record(user_id, created_at DESC);
+
+COMMIT;
@@ -6,11 +6,13 @@ import logging
 import json
 import uuid
 import zipfile
+import mmap
 import xml.etree.ElementTree as ET
 from html.parser import HTMLParser
 from pathlib import Path
 from typing import List, Tuple, Dict, Optional, Any
 from functools import wraps
+from contextlib import contextmanager
 import subprocess
 import textwrap
 
@@ -40,6 +42,13 @@ except ImportError:
     PYTESSERACT_AVAILABLE = False
     logging.warning("pytesseract not available - OCR functionality disabled")
 
+# Optional libvips for smaller JPEG output
+try:
+    import pyvips
+    PYVIPS_AVAILABLE = True
+except ImportError:
+    PYVIPS_AVAILABLE = False
+
 from PIL import Image
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import padding
@@ -125,6 +134,103 @@ def with_error_handling(method):
             
     return wrapper
 
+@contextmanager
+def open_pdf_mmap(file_path: str):
+    """
+    Memory-map a PDF read-only for pypdf so pages are faulted in on demand
+    and served from the page cache instead of being read into the heap.
+    """
+    with open(file_path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+def render_page_to_jpg(file_path: str, page_num: int, dpi: int, out_dir: str, token: Optional[str] = None) -> str:
+    """
+    Render a single PDF page to a JPG file and return its filename.
+
+    Kept at module level so it can be dispatched to a process pool; each call
+    opens its own document since PyMuPDF objects cannot be shared between workers.
+    A fixed token gives a deterministic filename; by default a random one is used.
+    """
+    zoom = dpi / 72.0
+    with fitz.open(file_path) as doc:
+        # JPEG has no alpha channel; ask for 3-byte RGB so MuPDF never allocates RGBA
+        pix = doc[page_num].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False, colorspace=fitz.csRGB)
+        image_filename = f"converted_page_{page_num + 1}_{token or uuid.uuid4().hex}.jpg"
+        # Write under a temporary name so a concurrent reader never sees a partial file
+        image_path = os.path.join(out_dir, f"{image_filename}.{uuid.uuid4().hex}.part")
+        if PYVIPS_AVAILABLE:
+            # mozjpeg-style coding gives noticeably smaller files for document rasters;
+            # samples_mv exposes MuPDF's pixel buffer without copying it into a bytes object
+            vi = pyvips.Image.new_from_memory(pix.samples_mv, pix.width, pix.height, pix.n, 'uchar')
+            vi.jpegsave(image_path, Q=90, optimize_coding=True, trellis_quant=True,
+                        overshoot_deringing=True, optimize_scans=True, interlace=True)
+        else:
+            # Encode straight from the pixmap buffer; no intermediate PIL image
+            pix.save(image_path, output="jpeg", jpg_quality=90)
+    os.replace(image_path, os.path.join(out_dir, image_filename))
+    return image_filename
+
+def split_pages_to_files(file_path: str, page_numbers: List[int], out_dir: str) -> List[str]:
+    """
+    Write each 1-based page in page_numbers to its own PDF in out_dir and return the filenames.
+
+    Module level so a Celery worker can split one block of a large document
+    without importing the web app.
+    """
+    created = []
+    with pikepdf.open(file_path) as pdf:
+        for page_num in page_numbers:
+            with pikepdf.new() as new_pdf:
+                new_pdf.pages.append(pdf.pages[page_num - 1])
+                split_filename = f"split_page_{page_num}_{uuid.uuid4().hex}.pdf"
+                # Only objects reachable from the copied page are written; packing them
+                # into object streams keeps shared fonts/resources compact
+                new_pdf.save(
+                    os.path.join(out_dir, split_filename),
+                    object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                    linearize=False
+                )
+            created.append(split_filename)
+    return created
+
+def extract_tables_range(file_path: str, start: int, stop: int) -> List[list]:
+    """
+    Extract tables from pages [start, stop) of a PDF with pdfplumber.
+
+    Returns one list of tables per page, in page order. Only the requested
+    pages are parsed, so contiguous ranges can be handed to a process pool.
+    """
+    page_tables = []
+    with pdfplumber.open(file_path, pages=range(start + 1, stop + 1)) as pdf:
+        for page in pdf.pages:
+            page_tables.append(page.extract_tables())
+            page.close()
+    return page_tables
+
+def merge_overlay_range(file_path: str, overlay_bytes: bytes, start: int, stop: int, per_page: bool) -> bytes:
+    """
+    Stamp overlay pages onto pages [start, stop) of a PDF and return the shard as PDF bytes.
+
+    When per_page is True the overlay holds one page per input page (e.g. page
+    numbers); otherwise its first page is stamped onto every page.
+    """
+    with open_pdf_mmap(file_path) as mm:
+        reader = pypdf.PdfReader(mm)
+        overlay_pages = pypdf.PdfReader(io.BytesIO(overlay_bytes)).pages
+        writer = pypdf.PdfWriter()
+        for i in range(start, stop):
+            page = reader.pages[i]
+            page.merge_page(overlay_pages[i] if per_page else overlay_pages[0])
+            writer.add_page(page)
+        # pypdf reads page content lazily, so serialize before the map is closed
+        out = io.BytesIO()
+        writer.write(out)
+    return out.getvalue()
+
 class PDFProcessor:
     """
     Comprehensive PDF processor with all features from new_operations.txt.
@@ -323,19 +429,21 @@ class PDFProcessor:
             raise PDFOperationError(f"merge_pdfs failed: {e}")
 
     @with_error_handling
-    def split_pdf(self, input_path: str, output_dir: str, **kwargs) -> str:
-        """Split PDF into individual page files."""
+    def split_pdf(self, input_path: str, output_dir: str, suffix: str = '', **kwargs) -> List[str]:
+        """Split PDF into individual page files named page_N{suffix}.pdf; returns the paths written, in page order."""
         input_path = self._validate_pdf(input_path)
         os.makedirs(output_dir, exist_ok=True)
         
         reader = PyPDF2.PdfReader(str(input_path))
+        written = []
         for page_num in range(len(reader.pages)):
             writer = PyPDF2.PdfWriter()
             writer.add_page(reader.pages[page_num])
-            output_file = os.path.join(output_dir, f"page_{page_num + 1}.pdf")
+            output_file = os.path.join(output_dir, f"page_{page_num + 1}{suffix}.pdf")
             with open(output_file, 'wb') as f:
                 writer.write(f)
-        return f"PDF split successfully into {output_dir}"
+            written.append(output_file)
+        return written
 
     @with_error_handling
     def extract_pages(self, input_path: str, output_path: str, pages: List[int], **kwargs) -> str:
@@ -728,32 +836,21 @@ class PDFProcessor:
         if not (has_digit and has_special):
             raise PDFValidationError("Password is too weak: must contain at least one digit and one special character")
         
-        reader = PyPDF2.PdfReader(str(input_path))
-        writer = PyPDF2.PdfWriter()
-        
-        for page in reader.pages:
-            writer.add_page(page)
-        writer.encrypt(user_password, owner_password, use_128bit=True)
-        
-        with open(output_path, 'wb') as f:
-            writer.write(f)
+        # AES-256 (R=6) in one qpdf pass; pypdf's RC4-128 rebuilt every page in Python
+        with pikepdf.open(input_path) as pdf:
+            pdf.save(
+                output_path,
+                encryption=pikepdf.Encryption(owner=owner_password or user_password, user=user_password, R=6, aes=True)
+            )
         return f"PDF protected: {output_path}"
 
     @with_error_handling
     def unlock_pdf(self, input_path: str, output_path: str, password: str, **kwargs) -> str:
         """Decrypt PDF if password known."""
         input_path = self._validate_pdf(input_path)
-        reader = PyPDF2.PdfReader(str(input_path))
-        
-        if reader.is_encrypted:
-            reader.decrypt(password)
-            
-        writer = PyPDF2.PdfWriter()
-        for page in reader.pages:
-            writer.add_page(page)
-            
-        with open(output_path, 'wb') as f:
-            writer.write(f)
+        # qpdf decrypts on open and writes the document back without encryption
+        with pikepdf.open(input_path, password=password) as pdf:
+            pdf.save(output_path)
         return f"PDF unlocked: {output_path}"
 
     @with_error_handling
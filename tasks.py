@@ -11,11 +11,11 @@
 # - Error handling and logging added for robustness.
 # - Note: Scanning the PDF means extracting text from it, which is done here to enable querying.
 
-from celery import shared_task
-from pdf_processor import PDFProcessor, PDFOperationError
+from celery import shared_task, chord
+from pdf_processor import PDFProcessor, PDFOperationError, render_page_to_jpg, split_pages_to_files
 import logging
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import requests  # For API calls
 
 try:
@@ -121,29 +121,35 @@ def classify_document(fpath: str) -> Dict[str, Any]:
         if not pdf_text:
             return {"error": "No text extracted from PDF"}
         
-        # Simple example ML model (train on dummy data for demo).
-        # In real use, load model from MLflow.
-        categories = ['invoice', 'contract', 'report', 'other']
-        train_texts = [
-            "Invoice number total amount due date",  # invoice
-            "Agreement parties terms conditions signature",  # contract
-            "Annual report financials analysis charts",  # report
-            "Random text miscellaneous"  # other
-        ]
-        vectorizer = TfidfVectorizer()
-        X_train = vectorizer.fit_transform(train_texts)
-        y_train = [0, 1, 2, 3]
-        model = MultinomialNB()
-        model.fit(X_train, y_train)
-        
-        X_test = vectorizer.transform([pdf_text])
-        pred = model.predict(X_test)[0]
-        category = categories[pred]
+        category = _classify_text(pdf_text)
         logger.info(f"Classified document {fpath} as {category}")
         return {"category": category}
     except Exception as e:
         return {"error": str(e)}
 
+def _classify_text(pdf_text: str) -> str:
+    """
+    Classify already-extracted PDF text into one of the demo categories.
+    """
+    # Simple example ML model (train on dummy data for demo).
+    # In real use, load model from MLflow.
+    categories = ['invoice', 'contract', 'report', 'other']
+    train_texts = [
+        "Invoice number total amount due date",  # invoice
+        "Agreement parties terms conditions signature",  # contract
+        "Annual report financials analysis charts",  # report
+        "Random text miscellaneous"  # other
+    ]
+    vectorizer = TfidfVectorizer()
+    X_train = vectorizer.fit_transform(train_texts)
+    y_train = [0, 1, 2, 3]
+    model = MultinomialNB()
+    model.fit(X_train, y_train)
+    
+    X_test = vectorizer.transform([pdf_text])
+    pred = model.predict(X_test)[0]
+    return categories[pred]
+
 @shared_task
 def workflow_master(fpath: str, commands: List[str]) -> Dict[str, Any]:
     """
@@ -153,26 +159,25 @@ def workflow_master(fpath: str, commands: List[str]) -> Dict[str, Any]:
     """
     try:
         results = {}
-        pdf_text = None  # Cache extracted text
+        pdf_text = None  # Cache extracted text; the PDF is parsed at most once per workflow
+        
+        def get_text() -> str:
+            nonlocal pdf_text
+            if pdf_text is None:
+                pdf_text = extract_pdf_text(fpath)
+            return pdf_text
         
         for cmd in commands:
             if cmd == 'extract_text':
-                pdf_text = extract_pdf_text(fpath)
-                results['extract_text'] = pdf_text[:500] + '...'  # Truncated for response
+                results['extract_text'] = get_text()[:500] + '...'  # Truncated for response
             elif cmd == 'analyze':
-                if pdf_text is None:
-                    pdf_text = extract_pdf_text(fpath)
-                prompt = f"Summarize: {pdf_text[:8000]}"
+                prompt = f"Summarize: {get_text()[:8000]}"
                 results['analyze'] = call_grok_api(prompt)
             elif cmd == 'classify':
-                if pdf_text is None:
-                    pdf_text = extract_pdf_text(fpath)
-                results['classify'] = classify_document(fpath)['category']  # Reuse function
+                results['classify'] = _classify_text(get_text())
             elif cmd.startswith('chat:'):
                 question = cmd.split(':', 1)[1]
-                if pdf_text is None:
-                    pdf_text = extract_pdf_text(fpath)
-                prompt = f"Answer '{question}' based on: {pdf_text[:8000]}"
+                prompt = f"Answer '{question}' based on: {get_text()[:8000]}"
                 results[f'chat_{question}'] = call_grok_api(prompt)
             else:
                 results[cmd] = {"error": "Unknown command"}
@@ -207,23 +212,73 @@ def multi_document_chat(file_paths: List[str], question: str) -> Dict[str, Any]:
     except Exception as e:
         return {"error": str(e)}
 
+# Drive downloads are streamed to disk in bounded chunks instead of buffered whole in memory
+DRIVE_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DRIVE_MEDIA_URL = "https://www.googleapis.com/drive/v3/files/{}?alt=media"
+# (connect, read) timeouts for the media stream; the read timeout applies per chunk
+DRIVE_DOWNLOAD_TIMEOUT = (10, 60)
+
 @shared_task
-def import_from_drive(user_id: int, drive_file_id: str) -> Dict[str, Any]:
+def import_from_drive(user_id: int, drive_file_id: str, meta: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
-    Import a file from Google Drive and process it.
-    This is a placeholder for Google Drive integration.
+    Import a file from Google Drive into the uploads folder and record it for the user.
+    meta is the file's Drive metadata when the caller already fetched it in a batch.
     """
     try:
-        # Placeholder implementation
-        # In real implementation, you would:
-        # 1. Use Google Drive API to download the file
-        # 2. Save it to the uploads folder
-        # 3. Create a FileRecord entry
-        # 4. Return the file key
+        import uuid
+        from urllib.parse import quote
+        from werkzeug.utils import secure_filename
+        from google.auth.transport.requests import AuthorizedSession
+        import app as web_app
         
         logger.info(f"Importing Drive file {drive_file_id} for user {user_id}")
-        return {"status": "imported", "file_id": drive_file_id}
+        with web_app.app.app_context():
+            user = web_app.db.session.get(web_app.User, user_id)
+            if not user or not user.google_drive_token:
+                return {"error": "Drive not connected"}
+            
+            # Cached per token in this worker process, so repeat imports skip client construction
+            service, creds = web_app.get_drive_service(user.google_drive_token)
+            if creds.expired and creds.refresh_token:
+                creds.refresh(web_app.drive_api().auth_request)
+            
+            if meta is None:
+                meta = service.files().get(fileId=drive_file_id, fields="name, mimeType").execute()
+            filename = secure_filename(meta.get('name') or f"{drive_file_id}.pdf")
+            unique_filename = f"{uuid.uuid4().hex}_{filename}"
+            local_path = os.path.join(web_app.UPLOAD_FOLDER, unique_filename)
+            
+            # One streamed GET; MediaIoBaseDownload issued a separate ranged request per chunk
+            part_path = f"{local_path}.{uuid.uuid4().hex}.part"
+            try:
+                with AuthorizedSession(creds, auth_request=web_app.drive_api().auth_request) as http, http.get(
+                    DRIVE_MEDIA_URL.format(quote(drive_file_id, safe='')), stream=True, timeout=DRIVE_DOWNLOAD_TIMEOUT
+                ) as resp:
+                    resp.raise_for_status()
+                    with open(part_path, 'wb') as fh:
+                        for chunk in resp.iter_content(DRIVE_DOWNLOAD_CHUNK_SIZE):
+                            fh.write(chunk)
+                os.replace(part_path, local_path)
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+            
+            file_record = web_app.FileRecord(
+                filename=unique_filename,
+                original_filename=filename,
+                file_size=os.path.getsize(local_path),
+                file_type=filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'pdf',
+                user_id=user_id,
+                mimetype=meta.get('mimeType'),
+                storage_path=os.path.abspath(local_path)
+            )
+            web_app.db.session.add(file_record)
+            web_app.db.session.commit()
+            
+            return {"status": "imported", "file_id": drive_file_id, "key": unique_filename, "filename": filename}
     except Exception as e:
+        logger.error(f"[Celery] Drive import failed: {e}", exc_info=True)
         return {"error": str(e)}
 
 @shared_task
@@ -255,8 +310,156 @@ def process_pdf_task(operation: str, input_paths: List[str], output_path: str, p
         logger.error(f"[Celery] Task failed: {e}", exc_info=True)
         return {"status": "FAILURE", "error": str(e)}
 
+# Rendering/overlay tasks that wrap the helpers in app.py. app is imported lazily
+# inside each task because app.py imports this module at load time.
+
+def _run_app_operation(name: str, file_key: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one of app.py's file_key based helpers and return its result dict"""
+    try:
+        import app as web_app
+        logger.info(f"[Celery] {name} -> file_key: {file_key}")
+        return getattr(web_app, name)(file_key, params or {})
+    except Exception as e:
+        logger.error(f"[Celery] {name} failed: {e}", exc_info=True)
+        return {"status": "FAILURE", "error": str(e)}
+
+@shared_task
+def pdf_to_jpg_task(file_key: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Render PDF pages to JPG in the background."""
+    return _run_app_operation('convert_to_jpg', file_key, params)
+
+@shared_task
+def watermark_task(file_key: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Stamp a text watermark onto every page in the background."""
+    return _run_app_operation('add_watermark', file_key, params)
+
+@shared_task
+def page_numbers_task(file_key: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Add page numbers in the background."""
+    return _run_app_operation('add_page_numbers', file_key, params)
+
+@shared_task
+def header_footer_task(file_key: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Add headers/footers in the background."""
+    return _run_app_operation('add_header_footer', file_key, params)
+
+@shared_task
+def protect_task(file_key: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Encrypt a PDF with a password in the background."""
+    return _run_app_operation('protect_pdf', file_key, params)
+
+@shared_task
+def word_task(file_key: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a PDF to Word in the background; returns the {"success", "result"} body /enhanced/convert sends inline."""
+    result = _run_app_operation('convert_to_word', file_key, params)
+    if result.get('status') == 'FAILURE':
+        return result
+    return {"success": True, "result": result}
+
+@shared_task
+def merge_task(user_id: int, file_paths: List[str], output_filename: str) -> Dict[str, Any]:
+    """
+    Merge a user's PDFs into output_filename and record the output as their file.
+    Returns the same {"success", "message", "result"} body /enhanced/merge sends inline.
+    """
+    try:
+        import app as web_app
+        logger.info(f"[Celery] merge -> {len(file_paths)} files, output: {output_filename}")
+        with web_app.app.app_context():
+            result = web_app.merge_and_record(user_id, file_paths, output_filename)
+        return {"success": True, "message": "Files merged successfully.", "result": result}
+    except Exception as e:
+        logger.error(f"[Celery] merge failed: {e}", exc_info=True)
+        return {"status": "FAILURE", "error": str(e)}
+
+@shared_task
+def processor_method_task(method_name: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run a PDFProcessor method (workflows, bulk jobs) in the background.
+    Returns the same {"success", "result"} body the /enhanced routes send inline.
+    """
+    try:
+        logger.info(f"[Celery] PDFProcessor.{method_name}")
+        return {"success": True, "result": getattr(PDFProcessor(), method_name)(**kwargs)}
+    except Exception as e:
+        logger.error(f"[Celery] PDFProcessor.{method_name} failed: {e}", exc_info=True)
+        return {"status": "FAILURE", "error": str(e)}
+
+# Page-batched PDF -> JPG: a large document is split into fixed-size page batches that
+# any worker can pick up, and a chord callback gathers the filenames at the end.
+
+JPG_PAGE_BATCH_SIZE = 10
+
+@shared_task
+def render_jpg_batch(file_path: str, page_indices: List[int], dpi: int, out_dir: str) -> List[str]:
+    """Render a slice of pages to JPG files and return their filenames."""
+    return [render_page_to_jpg(file_path, n, dpi, out_dir) for n in page_indices]
+
+def _collect_batches(batches: List[List[str]], out_dir: str, empty_error: str) -> Dict[str, Any]:
+    """Flatten per-batch filenames (in page order) into the usual key/filename/size result."""
+    files = [name for batch in batches for name in batch]
+    if not files:
+        return {"status": "FAILURE", "error": empty_error}
+    first_file = files[0]
+    return {
+        "key": first_file,
+        "filename": first_file,
+        "size": os.path.getsize(os.path.join(out_dir, first_file)),
+        "files": files,
+    }
+
+@shared_task
+def collect_jpg_batches(batches: List[List[str]], out_dir: str) -> Dict[str, Any]:
+    """Gather rendered JPG batches into a single result."""
+    return _collect_batches(batches, out_dir, "No images were created")
+
+def dispatch_pdf_to_jpg(file_path: str, page_indices: List[int], dpi: int, out_dir: str):
+    """Fan page batches out across workers; returns the AsyncResult of the collecting callback."""
+    batches = [page_indices[i:i + JPG_PAGE_BATCH_SIZE] for i in range(0, len(page_indices), JPG_PAGE_BATCH_SIZE)]
+    header = [render_jpg_batch.s(file_path, batch, dpi, out_dir) for batch in batches]
+    return chord(header)(collect_jpg_batches.s(out_dir))
+
+# Page-blocked split: documents with more than SPLIT_PAGE_BATCH_SIZE selected pages
+# are cut into blocks so several workers share the work and each holds one block.
+
+SPLIT_PAGE_BATCH_SIZE = 200
+
+@shared_task
+def split_pdf_batch(file_path: str, page_numbers: List[int], out_dir: str) -> List[str]:
+    """Split a block of 1-based pages into single-page PDFs and return their filenames."""
+    return split_pages_to_files(file_path, page_numbers, out_dir)
+
+@shared_task
+def collect_split_batches(batches: List[List[str]], out_dir: str) -> Dict[str, Any]:
+    """Gather split page batches into a single result."""
+    return _collect_batches(batches, out_dir, "No pages were split")
+
+def dispatch_split_pdf(file_path: str, page_numbers: List[int], out_dir: str):
+    """Fan page blocks out across workers; returns the AsyncResult of the collecting callback."""
+    blocks = [page_numbers[i:i + SPLIT_PAGE_BATCH_SIZE] for i in range(0, len(page_numbers), SPLIT_PAGE_BATCH_SIZE)]
+    header = [split_pdf_batch.s(file_path, block, out_dir) for block in blocks]
+    return chord(header)(collect_split_batches.s(out_dir))
+
 # Celery configuration
 from celery import Celery
+from kombu.serialization import register as register_serializer
+
+# orjson encodes task arguments/results natively; fall back to kombu's json without it
+try:
+    import orjson
+    register_serializer(
+        'orjson',
+        lambda obj: orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS),
+        orjson.loads,
+        content_type='application/x-orjson',
+        content_encoding='binary',
+    )
+    TASK_SERIALIZER = 'orjson'
+    # Keep accepting plain json so mixed-version workers and producers interoperate
+    TASK_ACCEPT_CONTENT = ['orjson', 'json']
+except ImportError:
+    TASK_SERIALIZER = 'json'
+    TASK_ACCEPT_CONTENT = ['json']
 
 # Configure Celery
 celery = Celery('pdf_tool')
@@ -266,16 +469,38 @@ from config_loader import get_celery_broker_url, get_celery_result_backend
 celery.conf.update(
     broker_url=get_celery_broker_url(),
     result_backend=get_celery_result_backend(),
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
+    task_serializer=TASK_SERIALIZER,
+    accept_content=TASK_ACCEPT_CONTENT,
+    result_serializer=TASK_SERIALIZER,
+    # Results stay in the shared backend so every web process can answer status polls; they
+    # must outlive the 24h /enhanced dedupe window that hands out existing task ids
+    result_expires=int(os.getenv('CELERY_RESULT_EXPIRES', 24 * 3600)),
+    # Finished results fetched by a web process are kept in a local LRU, so repeat polls
+    # of a done task skip the backend round trip
+    result_cache_max=int(os.getenv('CELERY_RESULT_CACHE_MAX', 1000)),
     timezone='UTC',
     enable_utc=True,
     task_track_started=True,
     task_time_limit=30 * 60,  # 30 minutes
     task_soft_time_limit=25 * 60,  # 25 minutes
+    worker_concurrency=min(os.cpu_count() or 1, 5),  # rendering is CPU-bound
 )
 
+# PDF work is split across two queues so CPU-bound rendering never sits behind (or starves)
+# I/O-bound conversions. Run separately sized workers, e.g.
+#   celery -A tasks worker -Q pdf_cpu --concurrency=<cpus> --prefetch-multiplier=1
+#   celery -A tasks worker -Q pdf_io --concurrency=<4 x cpus> --prefetch-multiplier=8
+PDF_CPU_QUEUE = 'pdf_cpu'
+PDF_IO_QUEUE = 'pdf_io'
+CPU_BOUND_COMMANDS = frozenset({
+    'compress', 'compress_pdf', 'pdf_to_jpg', 'watermark', 'watermark_pdf',
+    'page_numbers', 'add_page_numbers', 'header_footer', 'ocr_pdf_images',
+})
+
+def queue_for_command(command: str) -> str:
+    """Pick the PDF queue for a generic process_pdf_task command."""
+    return PDF_CPU_QUEUE if command in CPU_BOUND_COMMANDS else PDF_IO_QUEUE
+
 # Optional: Configure task routes
 celery.conf.task_routes = {
     'tasks.chat_with_pdf': {'queue': 'ai'},
@@ -283,8 +508,20 @@ celery.conf.task_routes = {
     'tasks.classify_document': {'queue': 'ai'},
     'tasks.workflow_master': {'queue': 'ai'},
     'tasks.multi_document_chat': {'queue': 'ai'},
-    'tasks.process_pdf_task': {'queue': 'pdf'},
-    'tasks.import_from_drive': {'queue': 'pdf'},
+    'tasks.process_pdf_task': {'queue': PDF_IO_QUEUE},  # overridden per command at dispatch
+    'tasks.pdf_to_jpg_task': {'queue': PDF_CPU_QUEUE},
+    'tasks.render_jpg_batch': {'queue': PDF_CPU_QUEUE},
+    'tasks.collect_jpg_batches': {'queue': PDF_IO_QUEUE},
+    'tasks.split_pdf_batch': {'queue': PDF_IO_QUEUE},
+    'tasks.collect_split_batches': {'queue': PDF_IO_QUEUE},
+    'tasks.watermark_task': {'queue': PDF_CPU_QUEUE},
+    'tasks.page_numbers_task': {'queue': PDF_CPU_QUEUE},
+    'tasks.header_footer_task': {'queue': PDF_CPU_QUEUE},
+    'tasks.protect_task': {'queue': PDF_IO_QUEUE},
+    'tasks.processor_method_task': {'queue': PDF_CPU_QUEUE},
+    'tasks.merge_task': {'queue': PDF_CPU_QUEUE},
+    'tasks.word_task': {'queue': PDF_CPU_QUEUE},
+    'tasks.import_from_drive': {'queue': PDF_IO_QUEUE},
 }
 
 if __name__ == '__main__':